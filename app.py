@@ -7,12 +7,15 @@ import streamlit as st
 import cv2
 import numpy as np
 from datetime import datetime
+from collections import deque
+import functools
+import itertools
 import time
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
-from facial_expression import FacialExpressionDetector
+from facial_expression import FacialExpressionDetector, select_device
 from audio_emotion import AudioEmotionDetector
 from conversation_ai import ConversationAI
 from critical_detector import CriticalIssueDetector
@@ -66,27 +69,161 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+EMOTION_NAMES = FacialExpressionDetector.EMOTION_NAMES
+LOCAL_TZ = datetime.now().astimezone().tzinfo
+EMOTION_TITLE = {e: e.title() for e in EMOTION_NAMES}
+SEVERITY_EMOJI = {
+    'high': '🔴',
+    'medium': '🟡',
+    'low': '🟢'
+}
+
+# Session limits
+EMOTION_HISTORY_SIZE = 100
+CONVERSATION_HISTORY_SIZE = 400
+MIN_INFERENCE_INTERVAL = 0.2  # seconds between processed camera frames
+
+
+def _reset_emotion_history():
+    """
+    Allocate the emotion history ring buffer in session state
+    
+    Entries are stored column-wise (epoch microseconds, emotion index, confidence and
+    per-emotion probabilities); emotion_count is the total number recorded,
+    so the newest entry lives at (emotion_count - 1) % EMOTION_HISTORY_SIZE.
+    """
+    st.session_state.emotion_ts = np.empty(EMOTION_HISTORY_SIZE, dtype=np.int64)
+    st.session_state.emotion_idx = np.empty(EMOTION_HISTORY_SIZE, dtype=np.int8)
+    st.session_state.emotion_conf = np.empty(EMOTION_HISTORY_SIZE, dtype=np.float16)
+    st.session_state.emotion_probs = np.empty((EMOTION_HISTORY_SIZE, len(EMOTION_NAMES)), dtype=np.float16)
+    st.session_state.emotion_count = 0
+
+
+def _record_emotion(ts_us: int, emotion: str, confidence: float, emotions: dict):
+    """Append one detection to the emotion history ring buffer"""
+    slot = st.session_state.emotion_count % EMOTION_HISTORY_SIZE
+    st.session_state.emotion_ts[slot] = ts_us
+    st.session_state.emotion_idx[slot] = EMOTION_NAMES.index(emotion)
+    st.session_state.emotion_conf[slot] = confidence
+    st.session_state.emotion_probs[slot] = [emotions.get(e, 0.0) for e in EMOTION_NAMES]
+    st.session_state.emotion_count += 1
+
+
+def _emotion_history_len() -> int:
+    """Number of entries currently held in the emotion history"""
+    return min(st.session_state.emotion_count, EMOTION_HISTORY_SIZE)
+
+
+def _emotion_slots(n: int) -> np.ndarray:
+    """Ring buffer slots of the last n entries, oldest first"""
+    count = st.session_state.emotion_count
+    n = min(n, _emotion_history_len())
+    return np.arange(count - n, count) % EMOTION_HISTORY_SIZE
+
+
+def _latest_emotion() -> dict:
+    """Return the newest emotion history entry"""
+    slot = (st.session_state.emotion_count - 1) % EMOTION_HISTORY_SIZE
+    return {
+        'emotion': EMOTION_NAMES[st.session_state.emotion_idx[slot]],
+        'confidence': float(st.session_state.emotion_conf[slot]),
+        'emotions': st.session_state.emotion_probs[slot]
+    }
+
+
 # Initialize session state
 if 'maitri' not in st.session_state:
     st.session_state.maitri = None
-if 'emotion_history' not in st.session_state:
-    st.session_state.emotion_history = []
+if 'emotion_count' not in st.session_state:
+    _reset_emotion_history()
 if 'conversation_history' not in st.session_state:
-    st.session_state.conversation_history = []
+    st.session_state.conversation_history = deque(maxlen=CONVERSATION_HISTORY_SIZE)
 if 'is_running' not in st.session_state:
     st.session_state.is_running = False
 if 'last_message_time' not in st.session_state:
     st.session_state.last_message_time = None
 
 
+@functools.lru_cache(maxsize=64)
+def _pretty(name: str) -> str:
+    """Turn an identifier like 'rapid_emotion_swings' into a display title"""
+    return name.replace('_', ' ').title()
+
+
+def _tail(items, n: int) -> list:
+    """Return the last n items of a list or deque"""
+    return list(itertools.islice(items, max(0, len(items) - n), None))
+
+
+@st.cache_data(ttl=5)
+def build_trend_figures(timestamps: np.ndarray, emotion_idx: np.ndarray, confidences: np.ndarray):
+    """
+    Build the emotion distribution and timeline charts
+    
+    Cached on the history snapshot so reruns with unchanged data skip the
+    DataFrame and figure construction.
+    
+    Args:
+        timestamps: Detection times in epoch microseconds
+        emotion_idx: Indices into EMOTION_NAMES
+        confidences: Confidence of each detection
+        
+    Returns:
+        Tuple of (pie_figure, line_figure)
+    """
+    df = pd.DataFrame({
+        'timestamp': pd.to_datetime(timestamps, unit='us', utc=True).tz_convert(LOCAL_TZ),
+        'emotion': np.take(EMOTION_NAMES, emotion_idx),
+        'confidence': confidences
+    })
+    
+    # Emotion distribution pie chart
+    emotion_counts = df['emotion'].value_counts()
+    pie_fig = px.pie(
+        values=emotion_counts.values, 
+        names=emotion_counts.index, 
+        title="Emotion Distribution",
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    pie_fig.update_traces(textposition='inside', textinfo='percent+label')
+    
+    # Timeline
+    line_fig = px.line(
+        df, 
+        x='timestamp', 
+        y='confidence', 
+        color='emotion',
+        title="Emotion Confidence Over Time",
+        labels={'confidence': 'Confidence Level', 'timestamp': 'Time'}
+    )
+    line_fig.update_layout(showlegend=True, height=300)
+    
+    return pie_fig, line_fig
+
+
+@st.cache_resource
+def get_facial_detector() -> FacialExpressionDetector:
+    """Facial detector shared by all sessions, loaded and warmed up once"""
+    detector = FacialExpressionDetector(device=select_device())
+    # Run one dummy frame so model loading/graph tracing happens at startup
+    detector.detect_emotion(np.zeros((224, 224, 3), dtype=np.uint8))
+    return detector
+
+
+@st.cache_resource
+def get_audio_detector() -> AudioEmotionDetector:
+    """Audio detector shared by all sessions"""
+    return AudioEmotionDetector()
+
+
 def initialize_maitri():
     """Initialize MAITRI components"""
     if st.session_state.maitri is None:
         with st.spinner("🔄 Initializing MAITRI components..."):
             try:
                 st.session_state.maitri = {
-                    'facial_detector': FacialExpressionDetector(),
-                    'audio_detector': AudioEmotionDetector(),
+                    'facial_detector': get_facial_detector(),
+                    'audio_detector': get_audio_detector(),
                     'conversation_ai': ConversationAI(),
                     'critical_detector': CriticalIssueDetector()
                 }
@@ -115,8 +252,8 @@ def main():
         
         if st.button("🔄 Initialize/Reset System", use_container_width=True, type="primary"):
             st.session_state.maitri = None
-            st.session_state.emotion_history = []
-            st.session_state.conversation_history = []
+            _reset_emotion_history()
+            st.session_state.conversation_history = deque(maxlen=CONVERSATION_HISTORY_SIZE)
             st.session_state.is_running = False
             initialize_maitri()
             st.rerun()
@@ -131,8 +268,8 @@ def main():
             st.markdown('<p class="status-inactive">❌ System Inactive</p>', unsafe_allow_html=True)
         
         # Quick stats
-        if st.session_state.emotion_history:
-            st.metric("Emotions Detected", len(st.session_state.emotion_history))
+        if st.session_state.emotion_count:
+            st.metric("Emotions Detected", _emotion_history_len())
         if st.session_state.conversation_history:
             st.metric("Conversations", len([m for m in st.session_state.conversation_history if m['role'] == 'user']))
         
@@ -174,58 +311,52 @@ def main():
                 # Use Streamlit's camera input
                 camera_img = st.camera_input("Camera Feed", label_visibility="collapsed")
                 
-                if camera_img is not None:
-                    # Convert to numpy array
-                    img_array = np.array(bytearray(camera_img.read()), dtype=np.uint8)
-                    frame = cv2.imdecode(img_array, cv2.IMREAD_COLOR)
+                # Skip frames arriving faster than inference can keep up with
+                since_last = time.monotonic() - st.session_state.get('last_infer_ts', 0.0)
+                
+                if camera_img is not None and since_last >= MIN_INFERENCE_INTERVAL:
+                    # Wrap the uploaded bytes without copying; imdecode only reads them
+                    img_array = np.frombuffer(camera_img.getvalue(), dtype=np.uint8)
+                    # Decode at half resolution; the face detector does not need full size
+                    frame = cv2.imdecode(img_array, cv2.IMREAD_REDUCED_COLOR_2)
                     
                     if frame is not None:
                         detector = st.session_state.maitri['facial_detector']
                         emotions = detector.detect_emotion(frame)
-                        dominant, confidence = detector.get_dominant_emotion(frame)
+                        dominant, confidence = max(emotions.items(), key=lambda x: x[1])
+                        st.session_state.last_infer_ts = time.monotonic()
                         
-                        # Store emotion
-                        emotion_data = {
-                            'timestamp': datetime.now(),
-                            'emotion': dominant,
-                            'confidence': confidence,
-                            'emotions': emotions
-                        }
-                        st.session_state.emotion_history.append(emotion_data)
+                        # Store emotion (ring buffer keeps the last EMOTION_HISTORY_SIZE)
+                        ts_us = time.time_ns() // 1000
+                        _record_emotion(ts_us, dominant, confidence, emotions)
                         
-                        # Keep last 100
-                        if len(st.session_state.emotion_history) > 100:
-                            st.session_state.emotion_history = st.session_state.emotion_history[-100:]
+                        # Feed the critical issue detector's sliding windows
+                        st.session_state.maitri['critical_detector'].ingest(
+                            dominant, confidence, ts_us / 1e6
+                        )
             else:
                 st.info("👆 Click 'Start Monitoring' to begin real-time emotion detection")
         
         with col_monitor2:
-            if st.session_state.emotion_history:
-                latest = st.session_state.emotion_history[-1]
+            if st.session_state.emotion_count:
+                latest = _latest_emotion()
                 st.markdown("### Current Status")
-                st.metric("Emotion", latest['emotion'].title(), delta=None)
+                st.metric("Emotion", EMOTION_TITLE[latest['emotion']], delta=None)
                 st.metric("Confidence", f"{latest['confidence']:.1%}")
                 
                 # Emotion breakdown
-                emotions = latest['emotions']
-                emotion_df = pd.DataFrame(list(emotions.items()), columns=['Emotion', 'Probability'])
+                emotion_df = pd.DataFrame({'Emotion': EMOTION_NAMES, 'Probability': latest['emotions']})
                 st.bar_chart(emotion_df.set_index('Emotion'), height=200)
                 
                 # Check for critical issues
-                if len(st.session_state.emotion_history) >= 5 and st.session_state.maitri:
+                if _emotion_history_len() >= 5 and st.session_state.maitri:
                     critical_detector = st.session_state.maitri['critical_detector']
-                    issues = critical_detector.check_critical_issues(
-                        [{
-                            'timestamp': e['timestamp'].isoformat(),
-                            'dominant_emotion': e['emotion'],
-                            'confidence': e['confidence']
-                        } for e in st.session_state.emotion_history[-20:]]
-                    )
+                    issues = critical_detector.check_critical_issues()
                     
                     if issues:
                         st.warning("⚠️ Critical Issue Detected!")
                         for issue in issues:
-                            with st.expander(f"🔴 {issue['type'].replace('_', ' ').title()}"):
+                            with st.expander(f"🔴 {_pretty(issue['type'])}"):
                                 st.write(f"**Severity:** {issue['severity']}")
                                 st.write(f"**Recommendation:** {issue['recommendation']}")
     
@@ -239,7 +370,7 @@ def main():
         with chat_container:
             # Display conversation history
             if st.session_state.conversation_history:
-                for msg in st.session_state.conversation_history[-20:]:  # Show last 20 messages
+                for msg in _tail(st.session_state.conversation_history, 20):  # Show last 20 messages
                     with st.chat_message(msg['role']):
                         st.write(msg['content'])
                         if 'timestamp' in msg:
@@ -268,8 +399,8 @@ def main():
         if send_button and user_input and st.session_state.maitri:
             with st.spinner("🤔 MAITRI is thinking..."):
                 # Get latest emotion
-                if st.session_state.emotion_history:
-                    latest = st.session_state.emotion_history[-1]
+                if st.session_state.emotion_count:
+                    latest = _latest_emotion()
                     emotion = latest['emotion']
                     confidence = latest['confidence']
                 else:
@@ -300,14 +431,18 @@ def main():
             with st.spinner("🎤 Recording audio (3 seconds)..."):
                 audio_detector = st.session_state.maitri['audio_detector']
                 try:
-                    audio_path = audio_detector.record_audio(duration=3.0)
-                    if audio_path:
-                        audio_emotion, conf = audio_detector.get_dominant_emotion(audio_path)
+                    # Streamlit runs this script synchronously, so the
+                    # session waits for the recording either way;
+                    # record_audio_async would only add an event loop here
+                    recording = audio_detector.record_audio(duration=3.0)
+                    if recording is not None:
+                        y, sr = recording
+                        audio_emotion, conf = audio_detector.get_dominant_emotion(y, sr)
                         st.success(f"🎵 Detected emotion: **{audio_emotion}** ({conf:.1%})")
                         
                         # Generate response
-                        if st.session_state.emotion_history:
-                            latest = st.session_state.emotion_history[-1]
+                        if st.session_state.emotion_count:
+                            latest = _latest_emotion()
                             emotion = latest['emotion']
                             confidence = latest['confidence']
                         else:
@@ -336,40 +471,15 @@ def main():
         
         with col_report1:
             st.markdown("#### 📈 Emotion Trends")
-            if st.session_state.emotion_history:
-                df = pd.DataFrame([
-                    {
-                        'timestamp': e['timestamp'],
-                        'emotion': e['emotion'],
-                        'confidence': e['confidence']
-                    }
-                    for e in st.session_state.emotion_history[-50:]
-                ])
-                
-                if not df.empty:
-                    # Emotion distribution pie chart
-                    emotion_counts = df['emotion'].value_counts()
-                    fig = px.pie(
-                        values=emotion_counts.values, 
-                        names=emotion_counts.index, 
-                        title="Emotion Distribution",
-                        color_discrete_sequence=px.colors.qualitative.Set3
-                    )
-                    fig.update_traces(textposition='inside', textinfo='percent+label')
-                    st.plotly_chart(fig, use_container_width=True)
-                    
-                    # Timeline
-                    df['timestamp'] = pd.to_datetime(df['timestamp'])
-                    fig2 = px.line(
-                        df, 
-                        x='timestamp', 
-                        y='confidence', 
-                        color='emotion',
-                        title="Emotion Confidence Over Time",
-                        labels={'confidence': 'Confidence Level', 'timestamp': 'Time'}
-                    )
-                    fig2.update_layout(showlegend=True, height=300)
-                    st.plotly_chart(fig2, use_container_width=True)
+            if st.session_state.emotion_count:
+                slots = _emotion_slots(50)
+                pie_fig, line_fig = build_trend_figures(
+                    st.session_state.emotion_ts[slots],
+                    st.session_state.emotion_idx[slots],
+                    st.session_state.emotion_conf[slots]
+                )
+                st.plotly_chart(pie_fig, use_container_width=True)
+                st.plotly_chart(line_fig, use_container_width=True)
             else:
                 st.info("📊 No emotion data yet. Start monitoring to collect data.")
         
@@ -381,12 +491,7 @@ def main():
                 
                 if issues:
                     for issue in issues[-5:]:
-                        severity_emoji = {
-                            'high': '🔴',
-                            'medium': '🟡',
-                            'low': '🟢'
-                        }
-                        with st.expander(f"{severity_emoji.get(issue['severity'], '⚪')} {issue['issue_type'].replace('_', ' ').title()}"):
+                        with st.expander(f"{SEVERITY_EMOJI.get(issue['severity'], '⚪')} {_pretty(issue['issue_type'])}"):
                             st.write(f"**Severity:** {issue['severity'].upper()}")
                             st.write(f"**Time:** {issue['timestamp']}")
                             if 'details' in issue:
@@ -416,7 +521,7 @@ def main():
                     st.metric("Critical Interventions", critical)
                 with col_metric2:
                     st.metric("Supportive Interventions", supportive)
-                    st.metric("Most Common Emotion", most_common.title())
+                    st.metric("Most Common Emotion", _pretty(most_common))
             else:
                 st.info("Initialize system to view conversation summary")
 
@@ -7,13 +7,95 @@ import librosa
 import numpy as np
 import soundfile as sf
 from sklearn.preprocessing import StandardScaler
-from typing import Dict, Tuple, Optional
+from typing import Callable, Dict, List, Tuple, Optional, Union
 import logging
 import os
+import asyncio
+import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Analysis settings; speech emotion cues sit well below the 8 kHz Nyquist limit
+SAMPLE_RATE = 16000
+N_FFT = 1024
+HOP_LENGTH = 256
+SILENCE_RMS_THRESHOLD = 0.005  # waveforms quieter than this are treated as silence
+
+# Extra seconds to wait for a recording's stream beyond its duration
+RECORD_TIMEOUT_SLACK = 2.0
+
+# Layout of the feature vector returned by extract_features
+N_MFCC = 13
+N_CHROMA = 12
+MFCC_MEAN = slice(0, N_MFCC)
+MFCC_STD = slice(N_MFCC, 2 * N_MFCC)
+CHROMA_MEAN = slice(2 * N_MFCC, 2 * N_MFCC + N_CHROMA)
+CHROMA_STD = slice(2 * N_MFCC + N_CHROMA, 2 * N_MFCC + 2 * N_CHROMA)
+MEL_MEAN = 2 * N_MFCC + 2 * N_CHROMA
+MEL_STD = MEL_MEAN + 1
+ZCR_MEAN = MEL_MEAN + 2
+ZCR_STD = MEL_MEAN + 3
+CENTROID_MEAN = MEL_MEAN + 4
+CENTROID_STD = MEL_MEAN + 5
+ROLLOFF_MEAN = MEL_MEAN + 6
+ROLLOFF_STD = MEL_MEAN + 7
+ONSET_RATE = MEL_MEAN + 8
+FEATURE_SIZE = ONSET_RATE + 1
+
+# Rules used by detect_emotion_from_features
+RULE_HAPPY = 0
+RULE_SAD = 1
+RULE_AGITATED = 2
+RULE_NEUTRAL = 3
+
+
+class _Recording:
+    """
+    One microphone recording on its own sounddevice input stream
+    
+    The stream callback copies blocks into this recording's own int16
+    buffer, so concurrent recordings (e.g. from several Streamlit sessions)
+    don't share sounddevice's process-global rec()/wait() state. `done` is
+    set when the buffer is full or the stream stops.
+    """
+    
+    def __init__(self, duration: float, sample_rate: int,
+                 on_done: Optional[Callable[[], None]] = None):
+        import sounddevice as sd
+        
+        self.samples = np.zeros((int(duration * sample_rate), 1), dtype=np.int16)
+        self.done = threading.Event()
+        self._pos = 0
+        self._on_done = on_done
+        self._stop = sd.CallbackStop
+        self._stream = sd.InputStream(samplerate=sample_rate, channels=1, dtype='int16',
+                                      callback=self._callback,
+                                      finished_callback=self._finished)
+        self._stream.start()
+    
+    def _callback(self, indata, frames, time_info, status):
+        """Copy one block into the buffer (audio thread)"""
+        n = min(frames, len(self.samples) - self._pos)
+        self.samples[self._pos:self._pos + n] = indata[:n]
+        self._pos += n
+        if self._pos >= len(self.samples):
+            raise self._stop
+    
+    def _finished(self):
+        """Signal completion once the stream has stopped (audio thread)"""
+        self.done.set()
+        if self._on_done is not None:
+            self._on_done()
+    
+    def waveform(self) -> np.ndarray:
+        """Recorded samples as a float32 mono waveform"""
+        return self.samples[:self._pos, 0].astype(np.float32) / 32768.0
+    
+    def close(self):
+        """Stop the stream if it is still running and release the device"""
+        self._stream.close()
+
 
 class AudioEmotionDetector:
     """Detects emotions from audio/voice input"""
@@ -22,8 +104,51 @@ class AudioEmotionDetector:
         """Initialize the audio emotion detector"""
         self.emotions = ['neutral', 'calm', 'happy', 'sad', 'angry', 'fearful', 'disgust', 'surprised']
         self.scaler = StandardScaler()
+        
+        # Feature vector returned for silent audio (classified as neutral)
+        self._silence_features = np.zeros(FEATURE_SIZE, dtype=np.float32)
+        
+        # Probability rows for each rule in detect_emotion_from_features
+        self._emotion_table = self._build_emotion_table(self.emotions)
+        
+        # Pay librosa's first-call costs once, at start-up
+        self._warmup()
         logger.info("Audio Emotion Detector initialized")
     
+    @staticmethod
+    def _build_emotion_table(emotions: List[str]) -> np.ndarray:
+        """
+        Probability table for detect_emotion_from_features
+        
+        Returns:
+            (4, len(emotions)) array indexed by RULE_* with columns ordered
+            as emotions; every row sums to 1
+        """
+        table = np.zeros((4, len(emotions)))
+        for rule_idx, probabilities in (
+            (RULE_HAPPY, {'happy': 0.6, 'neutral': 0.2, 'calm': 0.2}),
+            (RULE_SAD, {'sad': 0.6, 'neutral': 0.3, 'calm': 0.1}),
+            (RULE_AGITATED, {'angry': 0.5, 'fearful': 0.3, 'neutral': 0.2}),
+            (RULE_NEUTRAL, {'neutral': 0.7, 'calm': 0.3}),
+        ):
+            for emotion, p in probabilities.items():
+                table[rule_idx, emotions.index(emotion)] = p
+        return table
+    
+    def _warmup(self):
+        """
+        Run the feature pipeline once on a short synthetic tone
+        
+        librosa JIT-compiles several of its kernels on first use; doing it here
+        moves that delay from the first real recording to start-up.
+        """
+        try:
+            t = np.arange(0, 0.5, 1 / SAMPLE_RATE)
+            y = (0.5 * np.sin(2 * np.pi * 440 * t)).astype(np.float32)
+            self.extract_features_from_array(y, SAMPLE_RATE)
+        except Exception as e:
+            logger.warning(f"Audio pipeline warm-up failed: {e}")
+    
     def extract_features(self, audio_path: str, duration: float = 3.0) -> np.ndarray:
         """
         Extract audio features for emotion detection
@@ -37,50 +162,79 @@ class AudioEmotionDetector:
         """
         try:
             # Load audio file
-            y, sr = librosa.load(audio_path, duration=duration, sr=22050)
+            y, sr = librosa.load(audio_path, duration=duration, sr=SAMPLE_RATE)
+        except Exception as e:
+            logger.error(f"Error loading audio: {e}")
+            return np.zeros(FEATURE_SIZE, dtype=np.float32)
+        
+        return self.extract_features_from_array(y, sr)
+    
+    def extract_features_from_array(self, y: np.ndarray, sr: int) -> np.ndarray:
+        """
+        Extract audio features from an in-memory waveform
+        
+        Args:
+            y: Mono waveform (float, range -1..1)
+            sr: Sample rate of the waveform
+            
+        Returns:
+            Feature vector
+        """
+        try:
+            # Skip feature extraction entirely for (near) silent recordings
+            rms = np.sqrt(np.mean(np.square(y.astype(np.float32, copy=False))))
+            if rms < SILENCE_RMS_THRESHOLD:
+                return self._silence_features
             
-            # Extract features
-            features = []
+            features = np.empty(FEATURE_SIZE, dtype=np.float32)
+            
+            # Compute the spectrogram once and share it between feature extractors
+            magnitude = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+            power = magnitude ** 2
+            mel = librosa.feature.melspectrogram(S=power, sr=sr)
             
             # MFCC (Mel-frequency cepstral coefficients)
-            mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-            features.extend(np.mean(mfccs, axis=1))
-            features.extend(np.std(mfccs, axis=1))
+            log_mel = librosa.power_to_db(mel)
+            mfccs = librosa.feature.mfcc(S=log_mel, n_mfcc=N_MFCC)
+            features[MFCC_MEAN] = np.mean(mfccs, axis=1)
+            features[MFCC_STD] = np.std(mfccs, axis=1)
             
             # Chroma features
-            chroma = librosa.feature.chroma(y=y, sr=sr)
-            features.extend(np.mean(chroma, axis=1))
-            features.extend(np.std(chroma, axis=1))
+            chroma = librosa.feature.chroma_stft(S=power, sr=sr)
+            features[CHROMA_MEAN] = np.mean(chroma, axis=1)
+            features[CHROMA_STD] = np.std(chroma, axis=1)
             
             # Mel spectrogram
-            mel = librosa.feature.melspectrogram(y=y, sr=sr)
-            features.append(np.mean(mel))
-            features.append(np.std(mel))
+            features[MEL_MEAN] = np.mean(mel)
+            features[MEL_STD] = np.std(mel)
             
             # Zero crossing rate
-            zcr = librosa.feature.zero_crossing_rate(y)
-            features.append(np.mean(zcr))
-            features.append(np.std(zcr))
+            zcr = librosa.feature.zero_crossing_rate(y, frame_length=N_FFT, hop_length=HOP_LENGTH)
+            features[ZCR_MEAN] = np.mean(zcr)
+            features[ZCR_STD] = np.std(zcr)
             
             # Spectral centroid
-            spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)
-            features.append(np.mean(spectral_centroids))
-            features.append(np.std(spectral_centroids))
+            spectral_centroids = librosa.feature.spectral_centroid(S=magnitude, sr=sr)
+            features[CENTROID_MEAN] = np.mean(spectral_centroids)
+            features[CENTROID_STD] = np.std(spectral_centroids)
             
             # Spectral rolloff
-            spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-            features.append(np.mean(spectral_rolloff))
-            features.append(np.std(spectral_rolloff))
+            spectral_rolloff = librosa.feature.spectral_rolloff(S=magnitude, sr=sr)
+            features[ROLLOFF_MEAN] = np.mean(spectral_rolloff)
+            features[ROLLOFF_STD] = np.std(spectral_rolloff)
             
-            # Tempo
-            tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-            features.append(tempo)
+            # Onset rate (onsets per second); a cheap speaking-rate proxy that,
+            # unlike beat tracking, is meaningful on a 3 second clip
+            onset_env = librosa.onset.onset_strength(S=log_mel, sr=sr)
+            onsets = librosa.onset.onset_detect(onset_envelope=onset_env, sr=sr,
+                                                hop_length=HOP_LENGTH)
+            features[ONSET_RATE] = len(onsets) / (len(y) / sr)
             
-            return np.array(features)
+            return features
             
         except Exception as e:
             logger.error(f"Error extracting features: {e}")
-            return np.zeros(50)  # Return zero vector if error
+            return np.zeros(FEATURE_SIZE, dtype=np.float32)  # Return zero vector if error
     
     def detect_emotion_from_features(self, features: np.ndarray) -> Dict[str, float]:
         """
@@ -96,75 +250,95 @@ class AudioEmotionDetector:
         # This is a simplified rule-based approach
         # In production, use a trained classifier (SVM, Random Forest, or Neural Network)
         
-        # Normalize features
-        if len(features) > 0:
-            features = features / (np.abs(features).max() + 1e-8)
-        
-        # Simple heuristic-based emotion detection
-        # (This would be replaced with a trained model)
-        emotions = {}
-        
-        # Extract key features (simplified indices)
-        mfcc_mean = np.mean(features[:13]) if len(features) > 13 else 0
-        tempo = features[-1] if len(features) > 0 else 100
-        zcr = features[-3] if len(features) > 3 else 0
-        
-        # Rule-based emotion mapping
-        if tempo > 120 and mfcc_mean > 0.1:
-            emotions['happy'] = 0.6
-            emotions['neutral'] = 0.2
-            emotions['calm'] = 0.2
-        elif tempo < 80 and mfcc_mean < -0.1:
-            emotions['sad'] = 0.6
-            emotions['neutral'] = 0.3
-            emotions['calm'] = 0.1
-        elif zcr > 0.1:
-            emotions['angry'] = 0.5
-            emotions['fearful'] = 0.3
-            emotions['neutral'] = 0.2
-        else:
-            emotions['neutral'] = 0.7
-            emotions['calm'] = 0.3
-        
-        # Normalize probabilities
-        total = sum(emotions.values())
-        if total > 0:
-            emotions = {k: v/total for k, v in emotions.items()}
-        else:
-            emotions = {'neutral': 1.0}
+        if len(features) < FEATURE_SIZE:
+            return dict(zip(self.emotions, self._emotion_table[RULE_NEUTRAL].tolist()))
+        
+        # Onset rate and zero crossing rate are compared in their own units;
+        # the MFCC mean is taken relative to the largest feature magnitude
+        scale = np.max(np.abs(features)) + 1e-8
+        mfcc_mean = np.mean(features[MFCC_MEAN]) / scale
+        onset_rate = features[ONSET_RATE]
+        zcr = features[ZCR_MEAN]
         
+        # Rule-based emotion mapping: the first matching rule wins
+        rules = np.array([
+            onset_rate > 3.0 and mfcc_mean > 0.1,   # RULE_HAPPY
+            onset_rate < 1.5 and mfcc_mean < -0.1,  # RULE_SAD
+            zcr > 0.1,                              # RULE_AGITATED
+            True,                                   # RULE_NEUTRAL
+        ])
+        rule_idx = int(np.argmax(rules))
+        
+        emotions = dict(zip(self.emotions, self._emotion_table[rule_idx].tolist()))
         return emotions
     
-    def detect_emotion(self, audio_path: str) -> Dict[str, float]:
+    def detect_emotion(self, audio: Union[str, np.ndarray],
+                       sample_rate: Optional[int] = None) -> Dict[str, float]:
         """
-        Detect emotion from audio file
+        Detect emotion from an audio file or waveform
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or waveform as returned by record_audio
+            sample_rate: Sample rate of the waveform (required for arrays)
+            
+        Returns:
+            Dictionary with emotion probabilities
+        """
+        if isinstance(audio, np.ndarray):
+            return self.detect_emotion_from_array(audio, sample_rate)
+        features = self.extract_features(audio)
+        return self.detect_emotion_from_features(features)
+    
+    def detect_emotion_from_array(self, y: np.ndarray, sr: int) -> Dict[str, float]:
+        """
+        Detect emotion from an in-memory waveform
+        
+        Args:
+            y: Mono waveform (float, range -1..1)
+            sr: Sample rate of the waveform
             
         Returns:
             Dictionary with emotion probabilities
         """
-        features = self.extract_features(audio_path)
+        features = self.extract_features_from_array(y, sr)
         return self.detect_emotion_from_features(features)
     
-    def get_dominant_emotion(self, audio_path: str) -> Tuple[str, float]:
+    def get_dominant_emotion(self, audio: Union[str, np.ndarray],
+                             sample_rate: Optional[int] = None) -> Tuple[str, float]:
         """
         Get the dominant emotion from audio
         
         Args:
-            audio_path: Path to audio file
+            audio: Path to audio file, or waveform as returned by record_audio
+            sample_rate: Sample rate of the waveform (required for arrays)
             
         Returns:
             Tuple of (emotion_name, confidence)
         """
-        emotions = self.detect_emotion(audio_path)
+        emotions = self.detect_emotion(audio, sample_rate)
         if emotions:
             dominant = max(emotions.items(), key=lambda x: x[1])
             return dominant
         return ('neutral', 1.0)
     
-    def record_audio(self, duration: float = 3.0, sample_rate: int = 22050) -> str:
+    def start_recording(self, duration: float = 3.0, sample_rate: int = SAMPLE_RATE,
+                        on_done: Optional[Callable[[], None]] = None) -> '_Recording':
+        """
+        Start recording from the microphone without blocking
+        
+        Args:
+            duration: Recording duration in seconds
+            sample_rate: Sample rate for recording
+            on_done: Called from the audio thread once recording stops
+            
+        Returns:
+            Recording on its own input stream; close() it when finished
+        """
+        logger.info("Recording...")
+        return _Recording(duration, sample_rate, on_done)
+    
+    def record_audio(self, duration: float = 3.0,
+                     sample_rate: int = SAMPLE_RATE) -> Optional[Tuple[np.ndarray, int]]:
         """
         Record audio from microphone
         
@@ -173,49 +347,56 @@ class AudioEmotionDetector:
             sample_rate: Sample rate for recording
             
         Returns:
-            Path to saved audio file
+            Tuple of (waveform, sample_rate), or None if recording failed
         """
         try:
-            import pyaudio
-            import wave
-            
-            chunk = 1024
-            format = pyaudio.paInt16
-            channels = 1
+            recording = self.start_recording(duration, sample_rate)
+            try:
+                if not recording.done.wait(duration + RECORD_TIMEOUT_SLACK):
+                    raise TimeoutError("microphone stream did not finish")
+            finally:
+                recording.close()
+            logger.info("Finished recording")
             
-            p = pyaudio.PyAudio()
+            return recording.waveform(), sample_rate
             
-            stream = p.open(format=format,
-                          channels=channels,
-                          rate=sample_rate,
-                          input=True,
-                          frames_per_buffer=chunk)
+        except Exception as e:
+            logger.error(f"Error recording audio: {e}")
+            return None
+    
+    async def record_audio_async(self, duration: float = 3.0,
+                                 sample_rate: int = SAMPLE_RATE) -> Optional[Tuple[np.ndarray, int]]:
+        """
+        Record audio from microphone without blocking the event loop
+        
+        Only useful to callers that already run an event loop; wrapping it
+        in asyncio.run() blocks just like record_audio().
+        
+        Args:
+            duration: Recording duration in seconds
+            sample_rate: Sample rate for recording
             
-            logger.info("Recording...")
-            frames = []
+        Returns:
+            Tuple of (waveform, sample_rate), or None if recording failed
+        """
+        try:
+            loop = asyncio.get_running_loop()
+            finished = loop.create_future()
             
-            for _ in range(0, int(sample_rate / chunk * duration)):
-                data = stream.read(chunk)
-                frames.append(data)
+            def resolve():
+                if not finished.done():
+                    finished.set_result(None)
             
+            recording = self.start_recording(duration, sample_rate,
+                                             on_done=lambda: loop.call_soon_threadsafe(resolve))
+            try:
+                await asyncio.wait_for(finished, duration + RECORD_TIMEOUT_SLACK)
+            finally:
+                recording.close()
             logger.info("Finished recording")
             
-            stream.stop_stream()
-            stream.close()
-            p.terminate()
-            
-            # Save to file
-            output_path = "temp_audio.wav"
-            wf = wave.open(output_path, 'wb')
-            wf.setnchannels(channels)
-            wf.setsampwidth(p.get_sample_size(format))
-            wf.setframerate(sample_rate)
-            wf.writeframes(b''.join(frames))
-            wf.close()
-            
-            return output_path
+            return recording.waveform(), sample_rate
             
         except Exception as e:
             logger.error(f"Error recording audio: {e}")
             return None
-
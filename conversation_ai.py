@@ -3,7 +3,10 @@ Conversational AI Module
 Provides psychological support and adaptive conversations
 """
 
-import random
+import os
+import re
+import time
+from collections import Counter, deque
 from typing import Dict, List, Tuple, Optional
 import logging
 from datetime import datetime
@@ -11,16 +14,54 @@ from datetime import datetime
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Keyword groups for _respond_to_input, in priority order
+# (in production, use NLP/LLM)
+_KW_HELP = frozenset({'help', 'support', 'need'})
+_KW_TIRED = frozenset({'tired', 'exhausted', 'sleep'})
+_KW_STRESS = frozenset({'stress', 'stressed', 'pressure'})
+_KW_LONELY = frozenset({'lonely', 'alone', 'isolated'})
+_KW_THANKS = frozenset({'thank', 'thanks', 'appreciate'})
+_KW_FINE = frozenset({'fine', 'okay', 'good', 'well'})
+
+_KW_TABLE = (
+    (_KW_HELP, "I'm here to help. What specific support do you need right now?"),
+    (_KW_TIRED, "I understand you're feeling tired. Rest is important. Have you been able to get adequate sleep? Remember, your health is a priority."),
+    (_KW_STRESS, "Stress is a natural response. Let's work through this together. What's causing you the most stress right now?"),
+    (_KW_LONELY, "I understand that isolation can be challenging. Remember, you're part of a team, and we're all connected. Would you like to talk about what you're missing?"),
+    (_KW_THANKS, "You're welcome! I'm here whenever you need support. How are you feeling now?"),
+    (_KW_FINE, "That's good to hear! I'm glad you're doing well. Is there anything else you'd like to discuss?"),
+)
+
+_WORD_RE = re.compile(r"[a-z']+")
+
+# Emotions that call for supportive / critical interventions
+_NEGATIVE = frozenset({'sad', 'angry', 'fearful'})
+_CRITICAL = frozenset({'sad', 'angry'})
+
+# Maximum number of exchanges kept in conversation_history
+MAX_HISTORY = 10000
+
 
 class ConversationAI:
     """Provides adaptive conversations for psychological support"""
     
     def __init__(self):
         """Initialize the conversational AI"""
-        self.conversation_history = []
+        # Conversation log stored as parallel columns (see conversation_history)
+        self._h_ts = deque(maxlen=MAX_HISTORY)
+        self._h_emotion = deque(maxlen=MAX_HISTORY)
+        self._h_conf = deque(maxlen=MAX_HISTORY)
+        self._h_user = deque(maxlen=MAX_HISTORY)
+        self._h_resp = deque(maxlen=MAX_HISTORY)
+        self._h_intv = deque(maxlen=MAX_HISTORY)
         self.emotion_context = {}
         self.intervention_level = 'normal'  # normal, supportive, critical
         
+        # Running aggregates for get_conversation_summary
+        self._emo_counter = Counter()
+        self._intv_counter = Counter()
+        self._recent_emotions = deque(maxlen=10)
+        
         # Response templates based on emotions
         self.response_templates = {
             'sad': [
@@ -80,6 +121,13 @@ class ConversationAI:
             ]
         }
         
+        # Immutable template pools for _pick
+        self.response_templates = {k: tuple(v) for k, v in self.response_templates.items()}
+        self.interventions = {k: tuple(v) for k, v in self.interventions.items()}
+        
+        # xorshift64 state for _pick (must be non-zero)
+        self._rng = int.from_bytes(os.urandom(8), 'little') | 1
+        
         logger.info("Conversation AI initialized")
     
     def generate_response(self, emotion: str, confidence: float, 
@@ -100,19 +148,16 @@ class ConversationAI:
         # Determine primary emotion
         primary_emotion = emotion.lower()
         
-        # If audio emotion differs significantly, consider both
-        if audio_emotion and audio_emotion != primary_emotion:
-            # Combine insights
-            if primary_emotion in ['sad', 'angry', 'fearful']:
-                primary_emotion = primary_emotion  # Prioritize negative emotions
-            elif audio_emotion in ['sad', 'angry', 'fearful']:
-                primary_emotion = audio_emotion
+        # Prioritize negative emotions: a negative audio emotion only
+        # overrides a non-negative facial one
+        if audio_emotion and primary_emotion not in _NEGATIVE and audio_emotion in _NEGATIVE:
+            primary_emotion = audio_emotion
         
         # Check if intervention is needed
-        if confidence > 0.7 and primary_emotion in ['sad', 'angry', 'fearful']:
-            self.intervention_level = 'supportive'
-        elif confidence > 0.8 and primary_emotion in ['sad', 'angry']:
+        if confidence > 0.8 and primary_emotion in _CRITICAL:
             self.intervention_level = 'critical'
+        elif confidence > 0.7 and primary_emotion in _NEGATIVE:
+            self.intervention_level = 'supportive'
         else:
             self.intervention_level = 'normal'
         
@@ -123,33 +168,63 @@ class ConversationAI:
         else:
             # Proactive response based on emotion
             if primary_emotion in self.response_templates:
-                response = random.choice(self.response_templates[primary_emotion])
+                response = self._pick(self.response_templates[primary_emotion])
             else:
-                response = random.choice(self.response_templates['neutral'])
+                response = self._pick(self.response_templates['neutral'])
         
         # Add intervention if needed
         if self.intervention_level == 'supportive':
-            intervention = random.choice(self.interventions['breathing_exercise'])
+            intervention = self._pick(self.interventions['breathing_exercise'])
             response += f"\n\n{intervention}"
         elif self.intervention_level == 'critical':
-            intervention = random.choice(self.interventions['positive_reminder'])
+            intervention = self._pick(self.interventions['positive_reminder'])
             response += f"\n\n{intervention}"
             # Suggest activity
-            activity = random.choice(self.interventions['activity_suggestion'])
+            activity = self._pick(self.interventions['activity_suggestion'])
             response += f"\n\n{activity}"
         
+        # Update running summary statistics
+        self._emo_counter[primary_emotion] += 1
+        self._intv_counter[self.intervention_level] += 1
+        self._recent_emotions.append(primary_emotion)
+        
         # Log conversation
-        self.conversation_history.append({
-            'timestamp': datetime.now().isoformat(),
-            'emotion': primary_emotion,
-            'confidence': confidence,
-            'user_input': user_input,
-            'response': response,
-            'intervention_level': self.intervention_level
-        })
+        self._h_ts.append(time.time())
+        self._h_emotion.append(primary_emotion)
+        self._h_conf.append(confidence)
+        self._h_user.append(user_input)
+        self._h_resp.append(response)
+        self._h_intv.append(self.intervention_level)
         
         return response
     
+    @property
+    def conversation_history(self) -> List[Dict]:
+        """Conversation log as a list of dictionaries, built on demand"""
+        return [
+            {
+                'timestamp': datetime.fromtimestamp(ts).isoformat(),
+                'ts': ts,
+                'emotion': emotion,
+                'confidence': confidence,
+                'user_input': user_input,
+                'response': response,
+                'intervention_level': intervention_level
+            }
+            for ts, emotion, confidence, user_input, response, intervention_level in zip(
+                self._h_ts, self._h_emotion, self._h_conf,
+                self._h_user, self._h_resp, self._h_intv)
+        ]
+    
+    def _pick(self, pool: Tuple[str, ...]) -> str:
+        """Pick a pseudo-random item from a template pool (xorshift64)"""
+        x = self._rng
+        x ^= (x << 13) & 0xFFFFFFFFFFFFFFFF
+        x ^= x >> 7
+        x ^= (x << 17) & 0xFFFFFFFFFFFFFFFF
+        self._rng = x
+        return pool[x % len(pool)]
+    
     def _respond_to_input(self, user_input: str, emotion: str) -> str:
         """
         Respond to user's text input
@@ -161,33 +236,17 @@ class ConversationAI:
         Returns:
             Response string
         """
-        user_lower = user_input.lower()
-        
-        # Keyword-based responses (in production, use NLP/LLM)
-        if any(word in user_lower for word in ['help', 'support', 'need']):
-            return "I'm here to help. What specific support do you need right now?"
-        
-        elif any(word in user_lower for word in ['tired', 'exhausted', 'sleep']):
-            return "I understand you're feeling tired. Rest is important. Have you been able to get adequate sleep? Remember, your health is a priority."
-        
-        elif any(word in user_lower for word in ['stress', 'stressed', 'pressure']):
-            return "Stress is a natural response. Let's work through this together. What's causing you the most stress right now?"
-        
-        elif any(word in user_lower for word in ['lonely', 'alone', 'isolated']):
-            return "I understand that isolation can be challenging. Remember, you're part of a team, and we're all connected. Would you like to talk about what you're missing?"
-        
-        elif any(word in user_lower for word in ['thank', 'thanks', 'appreciate']):
-            return "You're welcome! I'm here whenever you need support. How are you feeling now?"
-        
-        elif any(word in user_lower for word in ['fine', 'okay', 'good', 'well']):
-            return "That's good to hear! I'm glad you're doing well. Is there anything else you'd like to discuss?"
+        # Match whole words only, so e.g. 'kneed' does not count as 'need'
+        tokens = frozenset(_WORD_RE.findall(user_input.lower()))
+        for keywords, response in _KW_TABLE:
+            if tokens & keywords:
+                return response
         
+        # Generic empathetic response
+        if emotion in _NEGATIVE:
+            return "I hear you. It sounds like you're going through something challenging. Would you like to talk more about it?"
         else:
-            # Generic empathetic response
-            if emotion in ['sad', 'angry', 'fearful']:
-                return "I hear you. It sounds like you're going through something challenging. Would you like to talk more about it?"
-            else:
-                return "Thank you for sharing. How can I best support you right now?"
+            return "Thank you for sharing. How can I best support you right now?"
     
     def get_conversation_summary(self) -> Dict:
         """
@@ -196,23 +255,23 @@ class ConversationAI:
         Returns:
             Dictionary with conversation summary
         """
-        if not self.conversation_history:
-            return {'total_interactions': 0}
-        
-        emotions = [entry['emotion'] for entry in self.conversation_history]
-        intervention_levels = [entry['intervention_level'] for entry in self.conversation_history]
-        
         return {
-            'total_interactions': len(self.conversation_history),
-            'most_common_emotion': max(set(emotions), key=emotions.count) if emotions else 'neutral',
-            'critical_interventions': intervention_levels.count('critical'),
-            'supportive_interventions': intervention_levels.count('supportive'),
-            'recent_emotions': emotions[-10:] if len(emotions) > 10 else emotions
+            # Counted from the aggregates, since the history itself is capped
+            'total_interactions': sum(self._intv_counter.values()),
+            'most_common_emotion': self._emo_counter.most_common(1)[0][0] if self._emo_counter else 'neutral',
+            'critical_interventions': self._intv_counter['critical'],
+            'supportive_interventions': self._intv_counter['supportive'],
+            'recent_emotions': list(self._recent_emotions)
         }
     
     def reset_conversation(self):
         """Reset conversation history"""
-        self.conversation_history = []
+        for column in (self._h_ts, self._h_emotion, self._h_conf,
+                       self._h_user, self._h_resp, self._h_intv):
+            column.clear()
         self.intervention_level = 'normal'
+        self._emo_counter.clear()
+        self._intv_counter.clear()
+        self._recent_emotions.clear()
         logger.info("Conversation history reset")
 
@@ -3,14 +3,99 @@ Critical Issue Detection Module
 Detects critical psychological or physical well-being issues
 """
 
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import logging
 from datetime import datetime, timedelta
 import json
+from functools import lru_cache
+import time
+from collections import deque
+
+import numpy as np
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Numba is optional - the scan kernels run as plain Python without it
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """No-op replacement for numba.njit"""
+        if args and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# Integer ids for the emotion labels produced by the facial and audio detectors
+EMOTION_LABELS = ('neutral', 'calm', 'happy', 'sad', 'angry', 'fearful', 'fear',
+                  'disgust', 'surprised', 'surprise')
+EMO_IDS = {e: i for i, e in enumerate(EMOTION_LABELS)}
+UNKNOWN_EMOTION = -1
+
+
+@njit(cache=True)
+def _sustained(ts, eid, conf, cutoff, neg_mask, conf_thr):
+    """Return (recent_count, negative_count, last_recent_idx) for ts >= cutoff"""
+    count = 0
+    negative = 0
+    last = -1
+    for i in range(ts.shape[0]):
+        if ts[i] >= cutoff:
+            count += 1
+            last = i
+            if eid[i] >= 0 and neg_mask[eid[i]] and conf[i] >= conf_thr:
+                negative += 1
+    return count, negative, last
+
+
+@njit(cache=True)
+def _swings(ts, eid, cutoff):
+    """Return (recent_count, emotion_changes) for ts >= cutoff"""
+    count = 0
+    changes = 0
+    prev = -2
+    for i in range(ts.shape[0]):
+        if ts[i] >= cutoff:
+            count += 1
+            if prev != -2 and eid[i] != prev:
+                changes += 1
+            prev = eid[i]
+    return count, changes
+
+
+@njit(cache=True)
+def _extreme(ts, eid, conf, cutoff, ext_mask, conf_thr):
+    """Return (recent_count, extreme_count, last_recent_idx) for ts >= cutoff"""
+    count = 0
+    extreme = 0
+    last = -1
+    for i in range(ts.shape[0]):
+        if ts[i] >= cutoff:
+            count += 1
+            last = i
+            if eid[i] >= 0 and ext_mask[eid[i]] and conf[i] >= conf_thr:
+                extreme += 1
+    return count, extreme, last
+
+
+@lru_cache(maxsize=256)
+def _format_issue(issue_type: str, severity: str, details_items: Tuple, recommendation: str) -> str:
+    """Report lines for one issue (without the issue number)"""
+    details_json = json.dumps(dict(details_items), indent=2, sort_keys=True)
+    return (f"{issue_type.replace('_', ' ').title()}\n"
+            f"Severity: {severity.upper()}\n"
+            f"Details: {details_json}\n"
+            f"Recommendation: {recommendation}\n\n")
+
+
+def _emotion_mask(emotions: List[str]) -> np.ndarray:
+    """uint8 lookup table over emotion ids, 1 for the given emotions"""
+    mask = np.zeros(len(EMOTION_LABELS), dtype=np.uint8)
+    for emotion in emotions:
+        if emotion in EMO_IDS:
+            mask[EMO_IDS[emotion]] = 1
+    return mask
+
 
 class CriticalIssueDetector:
     """Detects critical issues requiring ground control notification"""
@@ -38,16 +123,175 @@ class CriticalIssueDetector:
             }
         }
         
+        # Emotion sets encoded as lookup tables over emotion ids
+        self._negative_mask = _emotion_mask(self.critical_thresholds['sustained_negative_emotion']['emotion'])
+        self._extreme_mask = _emotion_mask(self.critical_thresholds['extreme_emotion']['emotion'])
+        
+        # Sliding windows of ingested (epoch seconds, emotion id, confidence)
+        # events, one per time-windowed check, with running counters
+        self._sustained_span = self.critical_thresholds['sustained_negative_emotion']['duration_minutes'] * 60
+        self._swing_span = self.critical_thresholds['rapid_emotion_swings']['time_window_minutes'] * 60
+        self._extreme_span = self.critical_thresholds['extreme_emotion']['duration_minutes'] * 60
+        self._sustained_win = deque()
+        self._swing_win = deque()
+        self._extreme_win = deque()
+        self._negative_count = 0
+        self._swing_changes = 0
+        self._extreme_count = 0
+        self._ingested = 0
+        
         logger.info("Critical Issue Detector initialized")
     
-    def check_critical_issues(self, emotion_data: List[Dict], 
+    def _is_negative(self, eid: int, confidence: float) -> bool:
+        """Whether an event counts towards sustained negative emotion"""
+        return (eid >= 0 and bool(self._negative_mask[eid]) and
+                confidence >= self.critical_thresholds['sustained_negative_emotion']['confidence_threshold'])
+    
+    def _is_extreme(self, eid: int, confidence: float) -> bool:
+        """Whether an event counts as an extreme emotion"""
+        return (eid >= 0 and bool(self._extreme_mask[eid]) and
+                confidence >= self.critical_thresholds['extreme_emotion']['confidence_threshold'])
+    
+    def ingest(self, emotion: str, confidence: float, ts: Optional[float] = None):
+        """
+        Add an emotion detection to the sliding windows
+        
+        Events must be ingested in chronological order. Checks run with
+        check_critical_issues() (no emotion_data) then read the running
+        counters instead of rescanning the history.
+        
+        Args:
+            emotion: Dominant emotion label
+            confidence: Confidence of the detection
+            ts: Detection time in epoch seconds (defaults to now)
+        """
+        if ts is None:
+            ts = time.time()
+        eid = EMO_IDS.get(emotion, UNKNOWN_EMOTION)
+        event = (ts, eid, confidence)
+        self._ingested += 1
+        
+        self._sustained_win.append(event)
+        if self._is_negative(eid, confidence):
+            self._negative_count += 1
+        
+        if self._swing_win and self._swing_win[-1][1] != eid:
+            self._swing_changes += 1
+        self._swing_win.append(event)
+        
+        self._extreme_win.append(event)
+        if self._is_extreme(eid, confidence):
+            self._extreme_count += 1
+        
+        self._expire(ts)
+    
+    def _expire(self, now_ts: float):
+        """Drop events that fell out of their window and update the counters"""
+        window = self._sustained_win
+        cutoff = now_ts - self._sustained_span
+        while window and window[0][0] < cutoff:
+            _, eid, confidence = window.popleft()
+            if self._is_negative(eid, confidence):
+                self._negative_count -= 1
+        
+        window = self._swing_win
+        cutoff = now_ts - self._swing_span
+        while window and window[0][0] < cutoff:
+            _, eid, _ = window.popleft()
+            if window and window[0][1] != eid:
+                self._swing_changes -= 1
+        
+        window = self._extreme_win
+        cutoff = now_ts - self._extreme_span
+        while window and window[0][0] < cutoff:
+            _, eid, confidence = window.popleft()
+            if self._is_extreme(eid, confidence):
+                self._extreme_count -= 1
+    
+    def _window_stats(self, now_ts: float) -> Dict:
+        """Check statistics read from the sliding-window counters"""
+        self._expire(now_ts)
+        last_sustained = self._sustained_win[-1] if self._sustained_win else (0.0, UNKNOWN_EMOTION, 0.0)
+        last_extreme = self._extreme_win[-1] if self._extreme_win else (0.0, UNKNOWN_EMOTION, 0.0)
+        return {
+            'sustained': (len(self._sustained_win), self._negative_count, last_sustained[1]),
+            'swings': (len(self._swing_win), self._swing_changes),
+            'extreme': (len(self._extreme_win), self._extreme_count, last_extreme[1], last_extreme[2])
+        }
+    
+    def _scan_stats(self, ts: np.ndarray, eid: np.ndarray, conf: np.ndarray, now_ts: float) -> Dict:
+        """
+        Check statistics computed by scanning event arrays
+        
+        The arrays must be in chronological order: each window start is
+        located by binary search and only the events inside it are scanned.
+        """
+        cutoffs = (now_ts - self._sustained_span, now_ts - self._swing_span, now_ts - self._extreme_span)
+        sustained_start, swing_start, extreme_start = np.searchsorted(ts, cutoffs, side='left').tolist()
+        
+        sustained_count, negative_count, _ = _sustained(
+            ts[sustained_start:], eid[sustained_start:], conf[sustained_start:], cutoffs[0],
+            self._negative_mask,
+            self.critical_thresholds['sustained_negative_emotion']['confidence_threshold']
+        )
+        extreme_count_recent, extreme_count, _ = _extreme(
+            ts[extreme_start:], eid[extreme_start:], conf[extreme_start:], cutoffs[2],
+            self._extreme_mask,
+            self.critical_thresholds['extreme_emotion']['confidence_threshold']
+        )
+        # The newest event closes every non-empty window
+        last_eid = int(eid[-1]) if len(eid) else UNKNOWN_EMOTION
+        last_conf = float(conf[-1]) if len(conf) else 0.0
+        return {
+            'sustained': (sustained_count, negative_count,
+                          last_eid if sustained_count else UNKNOWN_EMOTION),
+            'swings': _swings(ts[swing_start:], eid[swing_start:], cutoffs[1]),
+            'extreme': (extreme_count_recent, extreme_count,
+                        last_eid if extreme_count_recent else UNKNOWN_EMOTION,
+                        last_conf if extreme_count_recent else 0.0)
+        }
+    
+    @staticmethod
+    def _to_arrays(emotion_data: List[Dict], now_ts: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Convert emotion dictionaries to (epoch seconds, emotion id, confidence) arrays
+        
+        Entries carrying a float 'ts' (epoch seconds) are used as-is; otherwise
+        'timestamp' must be an ISO format string or an int (not bool) of
+        microseconds since the epoch. Entries without either count as current.
+        
+        Raises:
+            TypeError: If a 'timestamp' is neither a string nor an int
+        """
+        n = len(emotion_data)
+        ts = np.empty(n, dtype=np.float64)
+        eid = np.empty(n, dtype=np.int8)
+        conf = np.empty(n, dtype=np.float64)
+        for i, e in enumerate(emotion_data):
+            timestamp = e.get('timestamp')
+            if 'ts' in e:
+                ts[i] = e['ts']
+            elif timestamp is None:
+                ts[i] = now_ts
+            elif isinstance(timestamp, int) and not isinstance(timestamp, bool):
+                ts[i] = timestamp / 1e6
+            elif isinstance(timestamp, str):
+                ts[i] = datetime.fromisoformat(timestamp).timestamp()
+            else:
+                raise TypeError(f"Unsupported timestamp type: {type(timestamp).__name__}")
+            eid[i] = EMO_IDS.get(e.get('dominant_emotion'), UNKNOWN_EMOTION)
+            conf[i] = e.get('confidence', 0)
+        return ts, eid, conf
+    
+    def check_critical_issues(self, emotion_data: Optional[List[Dict]] = None, 
                             audio_data: List[Dict] = None,
                             last_interaction: datetime = None) -> List[Dict]:
         """
         Check for critical issues based on emotion patterns
         
         Args:
-            emotion_data: List of emotion dictionaries with timestamps
+            emotion_data: List of emotion dictionaries with timestamps, oldest
+                first (None uses the sliding windows filled by ingest())
             audio_data: List of audio emotion dictionaries (optional)
             last_interaction: Last time user interacted (optional)
             
@@ -55,32 +299,45 @@ class CriticalIssueDetector:
             List of detected critical issues
         """
         issues = []
-        
-        # Check sustained negative emotion
-        sustained = self._check_sustained_negative_emotion(emotion_data)
-        if sustained:
-            issues.append(sustained)
-        
-        # Check rapid emotion swings
-        swings = self._check_rapid_emotion_swings(emotion_data)
-        if swings:
-            issues.append(swings)
-        
-        # Check extreme emotions
-        extreme = self._check_extreme_emotion(emotion_data)
-        if extreme:
-            issues.append(extreme)
+        now = datetime.now()
+        now_ts = now.timestamp()
+        total = self._ingested if emotion_data is None else len(emotion_data)
+        
+        # The sustained and swing checks need 5 detections, the extreme check
+        # 2; with fewer, skip building the statistics altogether
+        if total >= 2:
+            if emotion_data is None:
+                stats = self._window_stats(now_ts)
+            else:
+                stats = self._scan_stats(*self._to_arrays(emotion_data, now_ts), now_ts)
+            
+            if total >= 5:
+                # Check sustained negative emotion
+                sustained = self._check_sustained_negative_emotion(*stats['sustained'])
+                if sustained:
+                    issues.append(sustained)
+                
+                # Check rapid emotion swings
+                swings = self._check_rapid_emotion_swings(*stats['swings'])
+                if swings:
+                    issues.append(swings)
+            
+            # Check extreme emotions
+            extreme = self._check_extreme_emotion(*stats['extreme'])
+            if extreme:
+                issues.append(extreme)
         
         # Check communication breakdown
         if last_interaction:
-            breakdown = self._check_communication_breakdown(last_interaction)
+            breakdown = self._check_communication_breakdown(last_interaction, now)
             if breakdown:
                 issues.append(breakdown)
         
         # Log issues
+        logged_at = now.isoformat()
         for issue in issues:
             self.issue_history.append({
-                'timestamp': datetime.now().isoformat(),
+                'timestamp': logged_at,
                 'issue_type': issue['type'],
                 'severity': issue['severity'],
                 'details': issue['details']
@@ -88,75 +345,42 @@ class CriticalIssueDetector:
         
         return issues
     
-    def _check_sustained_negative_emotion(self, emotion_data: List[Dict]) -> Dict:
+    @staticmethod
+    def _label(emotion_id: int) -> Optional[str]:
+        """Emotion label for an id (None if unknown)"""
+        return EMOTION_LABELS[emotion_id] if emotion_id >= 0 else None
+    
+    def _check_sustained_negative_emotion(self, recent_count: int, negative_count: int,
+                                          last_eid: int) -> Dict:
         """Check for sustained negative emotions"""
-        if len(emotion_data) < 5:
-            return None
-        
-        threshold = self.critical_thresholds['sustained_negative_emotion']
-        negative_emotions = threshold['emotion']
-        duration = threshold['duration_minutes']
-        confidence_threshold = threshold['confidence_threshold']
-        
-        # Get recent emotions within duration window
-        now = datetime.now()
-        recent_emotions = [
-            e for e in emotion_data 
-            if (now - datetime.fromisoformat(e.get('timestamp', now.isoformat()))).total_seconds() / 60 <= duration
-        ]
+        duration = self.critical_thresholds['sustained_negative_emotion']['duration_minutes']
         
-        if len(recent_emotions) < 3:
+        if recent_count < 3:
             return None
         
-        # Count negative emotions
-        negative_count = sum(
-            1 for e in recent_emotions 
-            if e.get('dominant_emotion') in negative_emotions 
-            and e.get('confidence', 0) >= confidence_threshold
-        )
-        
-        if negative_count >= len(recent_emotions) * 0.7:  # 70% of recent emotions are negative
+        if negative_count >= recent_count * 0.7:  # 70% of recent emotions are negative
             return {
                 'type': 'sustained_negative_emotion',
                 'severity': 'high',
                 'details': {
-                    'emotion': recent_emotions[-1].get('dominant_emotion'),
+                    'emotion': self._label(last_eid),
                     'duration_minutes': duration,
-                    'negative_percentage': (negative_count / len(recent_emotions)) * 100
+                    'negative_percentage': (negative_count / recent_count) * 100
                 },
                 'recommendation': 'Immediate psychological support recommended. Consider ground control notification.'
             }
         
         return None
     
-    def _check_rapid_emotion_swings(self, emotion_data: List[Dict]) -> Dict:
+    def _check_rapid_emotion_swings(self, recent_count: int, emotion_changes: int) -> Dict:
         """Check for rapid emotion swings"""
-        if len(emotion_data) < 5:
-            return None
-        
         threshold = self.critical_thresholds['rapid_emotion_swings']
         swings_per_minute = threshold['swings_per_minute']
         time_window = threshold['time_window_minutes']
         
-        # Get recent emotions
-        now = datetime.now()
-        recent_emotions = [
-            e for e in emotion_data 
-            if (now - datetime.fromisoformat(e.get('timestamp', now.isoformat()))).total_seconds() / 60 <= time_window
-        ]
-        
-        if len(recent_emotions) < 3:
+        if recent_count < 3:
             return None
         
-        # Count emotion changes
-        emotion_changes = 0
-        prev_emotion = None
-        for e in recent_emotions:
-            current = e.get('dominant_emotion')
-            if prev_emotion and current != prev_emotion:
-                emotion_changes += 1
-            prev_emotion = current
-        
         if emotion_changes >= swings_per_minute * time_window:
             return {
                 'type': 'rapid_emotion_swings',
@@ -170,40 +394,19 @@ class CriticalIssueDetector:
         
         return None
     
-    def _check_extreme_emotion(self, emotion_data: List[Dict]) -> Dict:
+    def _check_extreme_emotion(self, recent_count: int, extreme_count: int,
+                               last_eid: int, last_confidence: float) -> Dict:
         """Check for extreme emotions"""
-        if not emotion_data:
+        if recent_count == 0:
             return None
         
-        threshold = self.critical_thresholds['extreme_emotion']
-        extreme_emotions = threshold['emotion']
-        confidence_threshold = threshold['confidence_threshold']
-        duration = threshold['duration_minutes']
-        
-        # Get recent emotions
-        now = datetime.now()
-        recent_emotions = [
-            e for e in emotion_data 
-            if (now - datetime.fromisoformat(e.get('timestamp', now.isoformat()))).total_seconds() / 60 <= duration
-        ]
-        
-        if not recent_emotions:
-            return None
-        
-        # Check for extreme emotions
-        extreme_count = sum(
-            1 for e in recent_emotions 
-            if e.get('dominant_emotion') in extreme_emotions 
-            and e.get('confidence', 0) >= confidence_threshold
-        )
-        
         if extreme_count >= 2:  # At least 2 extreme emotion detections
             return {
                 'type': 'extreme_emotion',
                 'severity': 'high',
                 'details': {
-                    'emotion': recent_emotions[-1].get('dominant_emotion'),
-                    'confidence': recent_emotions[-1].get('confidence', 0),
+                    'emotion': self._label(last_eid),
+                    'confidence': last_confidence,
                     'occurrences': extreme_count
                 },
                 'recommendation': 'Immediate attention required. Consider ground control notification.'
@@ -211,7 +414,7 @@ class CriticalIssueDetector:
         
         return None
     
-    def _check_communication_breakdown(self, last_interaction: datetime) -> Dict:
+    def _check_communication_breakdown(self, last_interaction: datetime, now: datetime) -> Dict:
         """Check for communication breakdown"""
         threshold = self.critical_thresholds['communication_breakdown']
         no_response_minutes = threshold['no_response_minutes']
@@ -219,7 +422,7 @@ class CriticalIssueDetector:
         if not last_interaction:
             return None
         
-        minutes_since = (datetime.now() - last_interaction).total_seconds() / 60
+        minutes_since = (now - last_interaction).total_seconds() / 60
         
         if minutes_since >= no_response_minutes:
             return {
@@ -246,16 +449,24 @@ class CriticalIssueDetector:
         if not issues:
             return "No critical issues detected. All systems normal."
         
-        report = f"CRITICAL ISSUE REPORT - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        report += "=" * 50 + "\n\n"
+        parts = [f"CRITICAL ISSUE REPORT - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n",
+                 "=" * 50 + "\n\n"]
         
+        # Issues that persist across ticks reuse their formatted text, keyed
+        # on their sorted detail items; details holding unhashable values
+        # are formatted without the cache
         for i, issue in enumerate(issues, 1):
-            report += f"Issue #{i}: {issue['type'].replace('_', ' ').title()}\n"
-            report += f"Severity: {issue['severity'].upper()}\n"
-            report += f"Details: {json.dumps(issue['details'], indent=2)}\n"
-            report += f"Recommendation: {issue['recommendation']}\n\n"
-        
-        return report
+            details_items = tuple(sorted(issue['details'].items()))
+            try:
+                hash(details_items)
+                format_issue = _format_issue
+            except TypeError:
+                format_issue = _format_issue.__wrapped__
+            parts.append(f"Issue #{i}: ")
+            parts.append(format_issue(issue['type'], issue['severity'],
+                                      details_items, issue['recommendation']))
+        
+        return "".join(parts)
     
     def get_issue_history(self, hours: int = 24) -> List[Dict]:
         """
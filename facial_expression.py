@@ -5,8 +5,11 @@ Detects emotions from facial expressions using computer vision and deep learning
 
 import cv2
 import numpy as np
-from typing import Dict, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
 import logging
+import contextlib
+import threading
+import time
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -36,27 +39,90 @@ except ImportError:
     tf = None
 
 
+def select_device() -> str:
+    """
+    Pick the device for emotion inference
+    
+    Returns:
+        'gpu' if TensorFlow can see a GPU, otherwise 'cpu'
+    """
+    if tf is None:
+        return 'cpu'
+    try:
+        return 'gpu' if tf.config.list_physical_devices('GPU') else 'cpu'
+    except Exception:
+        return 'cpu'
+
+
 class FacialExpressionDetector:
     """Detects facial expressions and emotions from video frames"""
     
-    def __init__(self):
-        """Initialize the facial expression detector"""
+    # Emotion labels produced by FER, in a fixed order
+    EMOTION_NAMES = ('angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral')
+    
+    # Capacity of the quantized emotion history filled by record()
+    # (one day at one detection per second)
+    MAX_HISTORY = 86400
+    
+    def __init__(self, device: Optional[str] = None):
+        """
+        Initialize the facial expression detector
+        
+        Args:
+            device: 'cpu' or 'gpu' to pin inference to a device
+                (None leaves placement to TensorFlow)
+        """
         self.detector = None
-        self.emotions = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+        self.emotions = list(self.EMOTION_NAMES)
+        self._emo_idx = {e: i for i, e in enumerate(self.emotions)}
+        self.device = device
+        
+        # Ring buffer of recorded emotion vectors, quantized to uint8 (p * 255)
+        self._emo_hist = np.empty((self.MAX_HISTORY, len(self.emotions)), dtype=np.uint8)
+        self._emo_hist_n = 0
+        
+        # Frames are downscaled to this short edge before FER inference
+        self._target_short = 320
+        
+        # Haar cascade for the fallback path, loaded once
+        try:
+            self._face_cascade = cv2.CascadeClassifier(
+                cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
+            )
+        except Exception as e:
+            logger.error(f"Error loading face cascade: {e}")
+            self._face_cascade = None
+        
+        # Per-thread scratch buffers for the BGR->RGB and BGR->gray
+        # conversions; one detector may serve several threads at once
+        self._local = threading.local()
         
         if FER is None:
             logger.warning("FER library not available. Using fallback emotion detection.")
             return
             
         try:
-            # Initialize FER (Facial Expression Recognition) detector
-            self.detector = FER(mtcnn=True)
-            logger.info("Facial Expression Detector initialized successfully")
+            if tf is not None and device == 'gpu':
+                # Allocate GPU memory on demand rather than reserving all of it
+                for gpu in tf.config.list_physical_devices('GPU'):
+                    tf.config.experimental.set_memory_growth(gpu, True)
+            
+            # Initialize FER (Facial Expression Recognition) detector;
+            # building it inside the device scope places its weights there
+            with self._device_scope():
+                self.detector = FER(mtcnn=True)
+            logger.info(f"Facial Expression Detector initialized successfully (device: {device or 'default'})")
         except Exception as e:
             logger.error(f"Error initializing detector: {e}")
             logger.warning("Falling back to basic emotion detection")
             self.detector = None
     
+    def _device_scope(self):
+        """Context placing TensorFlow ops on the configured device"""
+        if tf is None or self.device is None:
+            return contextlib.nullcontext()
+        return tf.device('/GPU:0' if self.device == 'gpu' else '/CPU:0')
+    
     def detect_emotion(self, frame: np.ndarray) -> Dict[str, float]:
         """
         Detect emotion from a single frame
@@ -67,38 +133,122 @@ class FacialExpressionDetector:
         Returns:
             Dictionary with emotion probabilities
         """
+        return self._detect_emotion(frame)[0]
+    
+    def _downscale(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        Downscale a frame so its short edge is at most self._target_short
+        
+        Returns:
+            Tuple of (frame, scale) where scale maps original pixel
+            coordinates to the returned frame (1.0 if not resized)
+        """
+        h, w = frame.shape[:2]
+        scale = self._target_short / min(h, w)
+        if scale < 1:
+            return cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA), scale
+        return frame, 1.0
+    
+    def _buffer(self, name: str, shape: Tuple[int, ...]) -> np.ndarray:
+        """Calling thread's uint8 scratch buffer `name`, (re)allocated to shape"""
+        buf = getattr(self._local, name, None)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape, dtype=np.uint8)
+            setattr(self._local, name, buf)
+        return buf
+    
+    def _prepare(self, frame: np.ndarray) -> Tuple[np.ndarray, float]:
+        """
+        Downscale a BGR frame for inference and convert it to RGB
+        
+        Returns:
+            Tuple of (rgb_frame, scale) where scale maps original pixel
+            coordinates to the returned frame (1.0 if not resized).
+            rgb_frame is the calling thread's buffer, overwritten by its
+            next call.
+        """
+        frame, scale = self._downscale(frame)
+        rgb = self._buffer('rgb', frame.shape)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        return rgb, scale
+    
+    def _detect_emotion(self, frame: np.ndarray) -> Tuple[Dict[str, float], Optional[List[int]]]:
+        """
+        Run emotion detection on a frame
+        
+        Returns:
+            Tuple of (emotion_dict, box) with box as [x, y, w, h] in original
+            frame coordinates, or None when no face box is available
+        """
         if self.detector is None:
             # Fallback: Use basic face detection
-            return self._fallback_emotion_detection(frame)
+            return self._fallback_emotion_detection(frame), None
         
         try:
-            # Convert BGR to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Downscale and convert BGR to RGB
+            rgb_frame, scale = self._prepare(frame)
             
             # Detect emotions
-            result = self.detector.detect_emotions(rgb_frame)
+            with self._device_scope():
+                result = self.detector.detect_emotions(rgb_frame)
             
             if result and len(result) > 0:
-                # Get the first face detected
-                emotions = result[0]['emotions']
-                return emotions
+                # Get the first face detected, mapping its box back to
+                # original frame coordinates
+                box = [int(v / scale) for v in result[0]['box']]
+                return result[0]['emotions'], box
             else:
-                return {'neutral': 1.0}
+                return {'neutral': 1.0}, None
                 
         except Exception as e:
             logger.error(f"Error detecting emotion: {e}")
-            return self._fallback_emotion_detection(frame)
+            return self._fallback_emotion_detection(frame), None
+    
+    def analyze(self, frame_rgb: np.ndarray) -> Tuple[Dict[str, float], str, float, Optional[List[int]]]:
+        """
+        Detect emotions, the dominant emotion and the face box in one pass
+        
+        Args:
+            frame_rgb: Input image frame (RGB format)
+            
+        Returns:
+            Tuple of (emotion_dict, dominant_emotion, confidence, box) with
+            box as [x, y, w, h] in frame coordinates, or None without a face
+        """
+        box = None
+        if self.detector is None:
+            # Fallback path works on BGR; a reversed-channel view avoids a copy here
+            emotions = self._fallback_emotion_detection(frame_rgb[..., ::-1])
+        else:
+            try:
+                small, scale = self._downscale(frame_rgb)
+                with self._device_scope():
+                    result = self.detector.detect_emotions(small)
+                if result:
+                    emotions = result[0]['emotions']
+                    box = [int(v / scale) for v in result[0]['box']]
+                else:
+                    emotions = {'neutral': 1.0}
+            except Exception as e:
+                logger.error(f"Error detecting emotion: {e}")
+                emotions = self._fallback_emotion_detection(frame_rgb[..., ::-1])
+        
+        dominant_emotion, confidence = max(emotions.items(), key=lambda x: x[1])
+        return emotions, dominant_emotion, confidence, box
     
     def _fallback_emotion_detection(self, frame: np.ndarray) -> Dict[str, float]:
         """
         Fallback emotion detection using basic face detection
         Returns neutral emotion when FER is not available
         """
+        if self._face_cascade is None:
+            return {'neutral': 1.0}
+        
         try:
-            # Use OpenCV's face detector as fallback
-            face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+            # Use OpenCV's face detector as fallback, reusing this thread's gray buffer
+            gray = self._buffer('gray', frame.shape[:2])
+            cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+            faces = self._face_cascade.detectMultiScale(gray, 1.1, 4)
             
             if len(faces) > 0:
                 # Face detected but can't determine emotion - return neutral
@@ -141,77 +291,147 @@ class FacialExpressionDetector:
             logger.error("Error opening video source")
             return
         
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-            
-            # Detect emotion
-            emotions = self.detect_emotion(frame)
-            dominant_emotion, confidence = self.get_dominant_emotion(frame)
-            
-            # Draw bounding box and emotion on frame
-            if self.detector is not None:
-                try:
-                    result = self.detector.detect_emotions(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-                    if result:
-                        box = result[0]['box']
-                        x, y, w, h = box
-                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        cv2.putText(frame, f"{dominant_emotion}: {confidence:.2f}", 
-                                   (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                except Exception:
-                    # Fallback: use OpenCV face detection
-                    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    faces = face_cascade.detectMultiScale(gray, 1.1, 4)
-                    for (x, y, w, h) in faces:
-                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        cv2.putText(frame, f"{dominant_emotion}: {confidence:.2f}", 
-                                   (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
-                        break
-            
-            yield frame, emotions, (dominant_emotion, confidence)
+        # Capture and inference run on their own threads and only share the
+        # newest frame / newest result, so a slow model never stalls capture
+        lock = threading.Lock()
+        stop = threading.Event()
+        self._latest_frame = None
+        self._latest_result = None
         
-        cap.release()
+        def capture():
+            while not stop.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                with lock:
+                    self._latest_frame = frame
+            stop.set()
+        
+        def infer():
+            last = None
+            while not stop.is_set():
+                with lock:
+                    frame = self._latest_frame
+                if frame is None or frame is last:
+                    time.sleep(0.001)
+                    continue
+                last = frame
+                result = self._detect_emotion(frame)
+                with lock:
+                    self._latest_result = (frame, result)
+        
+        threads = [threading.Thread(target=capture, daemon=True),
+                   threading.Thread(target=infer, daemon=True)]
+        for thread in threads:
+            thread.start()
+        
+        try:
+            shown = None
+            held_box = None
+            while not stop.is_set():
+                with lock:
+                    latest = self._latest_result
+                if latest is None or latest is shown:
+                    time.sleep(0.001)
+                    continue
+                shown = latest
+                frame, (emotions, box) = latest
+                
+                dominant_emotion, confidence = max(emotions.items(), key=lambda x: x[1])
+                
+                # Keep the last face box for one frame when a detection
+                # misses, rather than running face detection again
+                if box is None and held_box is not None:
+                    box, held_box = held_box, None
+                else:
+                    held_box = box
+                
+                # Draw bounding box and emotion on frame
+                if box is not None:
+                    x, y, w, h = box
+                    cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                    cv2.putText(frame, f"{dominant_emotion}: {confidence:.2f}", 
+                               (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                
+                yield frame, emotions, (dominant_emotion, confidence)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+            cap.release()
+    
+    def record(self, emotions) -> None:
+        """
+        Store an emotion result in the quantized history
+        
+        Args:
+            emotions: Emotion dictionary, or vector ordered like self.emotions
+        """
+        if isinstance(emotions, dict):
+            vec = np.array([emotions.get(e, 0.0) for e in self.emotions], dtype=np.float32)
+        else:
+            vec = np.asarray(emotions)
+        row = self._emo_hist[self._emo_hist_n % self.MAX_HISTORY]
+        np.rint(np.clip(vec, 0.0, 1.0) * 255, out=row, casting='unsafe')
+        self._emo_hist_n += 1
     
-    def analyze_emotion_trend(self, emotion_history: list) -> Dict[str, any]:
+    def analyze_emotion_trend(self, emotion_history=None) -> Dict[str, any]:
         """
         Analyze emotion trends over time
         
         Args:
-            emotion_history: List of emotion dictionaries over time
+            emotion_history: List of emotion dictionaries over time, or an
+                (N, len(emotions)) array with columns ordered like
+                self.emotions (None uses the history stored with record())
             
         Returns:
             Analysis dictionary with trends and patterns
         """
-        if not emotion_history:
-            return {'trend': 'stable', 'dominant': 'neutral'}
-        
-        # Calculate average emotions
-        avg_emotions = {}
-        for emotion in self.emotions:
-            avg_emotions[emotion] = np.mean([e.get(emotion, 0) for e in emotion_history])
-        
-        dominant = max(avg_emotions.items(), key=lambda x: x[1])
+        if emotion_history is None:
+            n = self._emo_hist_n
+            if n == 0:
+                return {'trend': 'stable', 'dominant': 'neutral'}
+            stored = self._emo_hist[:min(n, self.MAX_HISTORY)]
+            recent_rows = np.arange(max(0, n - 10), n) % self.MAX_HISTORY
+            avg = stored.mean(axis=0, dtype=np.float32) / 255.0
+            recent_avg = self._emo_hist[recent_rows].mean(axis=0, dtype=np.float32) / 255.0
+        else:
+            if len(emotion_history) == 0:
+                return {'trend': 'stable', 'dominant': 'neutral'}
+            if isinstance(emotion_history, np.ndarray):
+                history = emotion_history
+            else:
+                history = self._pack(emotion_history)
+            avg = history.mean(axis=0)
+            recent_avg = history[-10:].mean(axis=0)
         
-        # Detect trends
-        recent = emotion_history[-10:] if len(emotion_history) >= 10 else emotion_history
-        recent_avg = {}
-        for emotion in self.emotions:
-            recent_avg[emotion] = np.mean([e.get(emotion, 0) for e in recent])
+        # Dominant emotion by average probability
+        dominant_idx = int(avg.argmax())
         
-        # Compare with overall average
+        # Detect trends: compare recent with overall average
+        sad, happy = self._emo_idx['sad'], self._emo_idx['happy']
         trend = 'stable'
-        if recent_avg.get('sad', 0) > avg_emotions.get('sad', 0) + 0.2:
+        if recent_avg[sad] > avg[sad] + 0.2:
             trend = 'declining'
-        elif recent_avg.get('happy', 0) > avg_emotions.get('happy', 0) + 0.2:
+        elif recent_avg[happy] > avg[happy] + 0.2:
             trend = 'improving'
         
         return {
             'trend': trend,
-            'dominant': dominant[0],
-            'confidence': dominant[1],
-            'averages': avg_emotions
+            'dominant': self.emotions[dominant_idx],
+            'confidence': float(avg[dominant_idx]),
+            'averages': dict(zip(self.emotions, avg.tolist()))
         }
-
+    
+    def _pack(self, emotion_history: list) -> np.ndarray:
+        """
+        Stack emotion dictionaries into an (N, len(emotions)) float32 array
+        
+        Columns follow self.emotions; missing emotions count as 0.
+        """
+        n_emotions = len(self.emotions)
+        return np.fromiter(
+            (e.get(emotion, 0.0) for e in emotion_history for emotion in self.emotions),
+            dtype=np.float32,
+            count=len(emotion_history) * n_emotions
+        ).reshape(-1, n_emotions)
@@ -3,12 +3,29 @@ MAITRI - Main Application
 AI Assistant for Psychological & Physical Well-Being of Astronauts
 """
 
+import argparse
+import os
+
+# Split the cores between OpenCV and TensorFlow instead of letting both
+# size their pools to the whole machine. This has to happen before
+# TensorFlow is imported (via facial_expression); explicit settings win.
+WORKER_THREADS = max(1, (os.cpu_count() or 2) // 2)
+os.environ.setdefault('OMP_NUM_THREADS', str(WORKER_THREADS))
+os.environ.setdefault('TF_NUM_INTRAOP_THREADS', str(WORKER_THREADS))
+os.environ.setdefault('TF_NUM_INTEROP_THREADS', '2')
+
 import cv2
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import time
+from collections import deque
 from datetime import datetime
 from typing import Optional
 import logging
 
+import numpy as np
+
 from facial_expression import FacialExpressionDetector
 from audio_emotion import AudioEmotionDetector
 from conversation_ai import ConversationAI
@@ -17,6 +34,21 @@ from critical_detector import CriticalIssueDetector
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Camera capture resolution requested from the driver
+CAPTURE_WIDTH = 640
+CAPTURE_HEIGHT = 480
+
+# Frames are shrunk by this factor before facial emotion detection
+DETECTION_SCALE = 0.33
+
+# Only every Nth displayed frame is sent for emotion detection
+DETECTION_INTERVAL = 5
+
+# cv2.pollKey (OpenCV >= 4.5) checks for a key press without waitKey's 1 ms sleep
+_poll_key = getattr(cv2, 'pollKey', None) or (lambda: cv2.waitKey(1))
+
+# Dominant emotions that trigger a proactive response
+_RESPONSE_EMOTIONS = frozenset({'sad', 'angry', 'fearful'})
 
 
 class MAITRI:
@@ -26,25 +58,48 @@ class MAITRI:
         """Initialize MAITRI components"""
         logger.info("Initializing MAITRI...")
         
+        # Keep OpenCV's SIMD paths on and its thread pool to its share of cores
+        cv2.setUseOptimized(True)
+        cv2.setNumThreads(WORKER_THREADS)
+        
         self.facial_detector = FacialExpressionDetector()
         self.audio_detector = AudioEmotionDetector()
         self.conversation_ai = ConversationAI()
         self.critical_detector = CriticalIssueDetector()
         
         # Data storage
-        self.emotion_history = []
-        self.audio_history = []
+        self.emotion_history = deque(maxlen=100)
+        self.audio_history = deque(maxlen=100)
+        
         self.last_interaction = datetime.now()
         
+        # Latest decoded camera frame, filled by the grabber thread
+        self._frames = queue.Queue(maxsize=1)
+        self._stop = threading.Event()
+        
+        # Single worker for facial inference, off the display thread
+        self._inference = ThreadPoolExecutor(max_workers=1)
+        
+        # Audio interactions record and analyse on their own worker;
+        # _recording blocks re-entry while one is in flight
+        self._audio = ThreadPoolExecutor(max_workers=1)
+        self._audio_pending = None
+        self._recording = False
+        
+        # Last rendered overlay label: (text, strip, mask, baseline_row)
+        self._label_cache = None
+        
         logger.info("MAITRI initialized successfully")
     
-    def run(self, video_source: int = 0, enable_audio: bool = True):
+    def run(self, video_source: int = 0, enable_audio: bool = True, use_ocl: bool = False):
         """
         Run the main application loop
         
         Args:
             video_source: Video source (0 for webcam)
             enable_audio: Whether to enable audio analysis
+            use_ocl: Run resize/colour conversion/drawing on cv2.UMat so
+                OpenCV can dispatch them to OpenCL
         """
         logger.info("Starting MAITRI...")
         print("\n" + "="*60)
@@ -52,60 +107,83 @@ class MAITRI:
         print("="*60)
         print("\nPress 'q' to quit, 's' to speak, 'r' for report\n")
         
+        if use_ocl:
+            cv2.ocl.setUseOpenCL(True)
+            if not cv2.ocl.haveOpenCL():
+                logger.warning("OpenCL not available; UMat operations will run on the CPU")
+        
         cap = cv2.VideoCapture(video_source)
         
         if not cap.isOpened():
             logger.error("Error opening video source")
             return
         
-        frame_count = 0
+        # Low-latency capture: keep one buffered frame and ask for MJPEG at a
+        # modest resolution (drivers ignore settings they don't support)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+        
         last_emotion_check = time.time()
         emotion_check_interval = 2.0  # Check emotion every 2 seconds
         
+        # Capture runs on its own thread so slow inference never stalls it
+        self._stop.clear()
+        while not self._frames.empty():
+            self._frames.get_nowait()
+        grabber = threading.Thread(target=self._grabber_loop, args=(cap,), daemon=True)
+        grabber.start()
+        
+        # At most one inference runs at a time; the last finished result
+        # keeps being drawn on the frames shown in between. While it runs
+        # only the newest sampled frame is kept; older ones are dropped.
+        pending = None
+        pending_ts = None
+        latest = None
+        overlay = None
+        frame_count = 0
+        
         try:
             while True:
-                ret, frame = cap.read()
-                if not ret:
+                frame = self._frames.get()
+                if frame is None:
                     break
-                
-                frame_count += 1
                 current_time = time.time()
+                frame_count += 1
+                
+                # Finish an audio interaction once its recording is analysed
+                if self._audio_pending is not None and self._audio_pending.done():
+                    self._finish_audio_interaction()
+                
+                # Image operations below work on either ndarray or UMat
+                canvas = cv2.UMat(frame) if use_ocl else frame
                 
-                # Process frame every few frames for performance
-                if frame_count % 5 == 0:
-                    # Detect facial expression
-                    emotions = self.facial_detector.detect_emotion(frame)
-                    dominant_emotion, confidence = self.facial_detector.get_dominant_emotion(frame)
+                if pending is not None and pending.done():
+                    emotions, dominant_emotion, confidence, box = pending.result()
+                    pending = None
                     
-                    # Store emotion data
+                    # Store emotion data (epoch seconds of capture; format
+                    # only when displayed)
                     emotion_data = {
-                        'timestamp': datetime.now().isoformat(),
+                        'ts': pending_ts,
                         'emotions': emotions,
                         'dominant_emotion': dominant_emotion,
                         'confidence': confidence
                     }
                     self.emotion_history.append(emotion_data)
+                    self.critical_detector.ingest(dominant_emotion, confidence, pending_ts)
+                    self.facial_detector.record(emotions)
                     
-                    # Keep only last 100 entries
-                    if len(self.emotion_history) > 100:
-                        self.emotion_history = self.emotion_history[-100:]
-                    
-                    # Draw on frame
-                    result = self.facial_detector.detector.detect_emotions(
-                        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    ) if self.facial_detector.detector else None
-                    
-                    if result:
-                        box = result[0]['box']
-                        x, y, w, h = box
-                        cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                        cv2.putText(frame, f"{dominant_emotion}: {confidence:.2f}", 
-                                   (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                    if box is not None:
+                        # Map the box back to the full-resolution frame
+                        box = [int(v / DETECTION_SCALE) for v in box]
+                    overlay = (dominant_emotion, confidence, box)
                     
                     # Check for critical issues periodically
                     if current_time - last_emotion_check >= emotion_check_interval:
                         issues = self.critical_detector.check_critical_issues(
-                            self.emotion_history,
+                            None,
                             self.audio_history,
                             self.last_interaction
                         )
@@ -117,20 +195,46 @@ class MAITRI:
                             logger.warning(f"Critical issues detected: {len(issues)}")
                         
                         # Generate proactive response if needed
-                        if confidence > 0.6 and dominant_emotion in ['sad', 'angry', 'fearful']:
+                        if confidence > 0.6 and dominant_emotion in _RESPONSE_EMOTIONS:
                             response = self.conversation_ai.generate_response(
                                 dominant_emotion, confidence
                             )
                             print(f"\nMAITRI: {response}\n")
-                            self.last_interaction = datetime.now()
+                            self.last_interaction = datetime.fromtimestamp(current_time)
                         
                         last_emotion_check = current_time
                 
+                # Process frame every few frames for performance. Downscale
+                # and convert once; the resulting copy is also what keeps the
+                # worker's input separate from the frame we draw on
+                if frame_count % DETECTION_INTERVAL == 0:
+                    small = cv2.resize(canvas, (0, 0), fx=DETECTION_SCALE, fy=DETECTION_SCALE,
+                                       interpolation=cv2.INTER_AREA)
+                    rgb_frame = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                    if use_ocl:
+                        rgb_frame = rgb_frame.get()
+                    latest = (current_time, rgb_frame)
+                
+                if pending is None and latest is not None:
+                    pending_ts, rgb_frame = latest
+                    latest = None
+                    pending = self._inference.submit(self.facial_detector.analyze, rgb_frame)
+                
+                # Draw on the display frame only; the worker has its own copy
+                if overlay is not None and overlay[2] is not None:
+                    dominant_emotion, confidence, (x, y, w, h) = overlay
+                    label = f"{dominant_emotion}: {confidence:.2f}"
+                    cv2.rectangle(canvas, (x, y), (x+w, y+h), (0, 255, 0), 2)
+                    if use_ocl:
+                        cv2.putText(canvas, label, (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+                    else:
+                        self._draw_label(canvas, label, x, y-10)
+                
                 # Display frame
-                cv2.imshow('MAITRI - Emotion Detection', frame)
+                cv2.imshow('MAITRI - Emotion Detection', canvas)
                 
                 # Handle keyboard input
-                key = cv2.waitKey(1) & 0xFF
+                key = _poll_key() & 0xFF
                 if key == ord('q'):
                     break
                 elif key == ord('s'):
@@ -150,22 +254,93 @@ class MAITRI:
         except KeyboardInterrupt:
             logger.info("Application interrupted by user")
         finally:
+            if pending is not None:
+                pending.cancel()
+            self._stop.set()
+            grabber.join()
             cap.release()
             cv2.destroyAllWindows()
             logger.info("MAITRI session ended")
     
+    def _draw_label(self, frame, text: str, x: int, y: int):
+        """
+        Draw an overlay label with its baseline at (x, y)
+        
+        The text is rasterized once per distinct label into a small strip,
+        which is then copied onto each frame through its glyph mask.
+        """
+        if self._label_cache is None or self._label_cache[0] != text:
+            (text_w, text_h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.9, 2)
+            strip = np.zeros((text_h + baseline + 4, text_w + 4, 3), dtype=np.uint8)
+            cv2.putText(strip, text, (2, text_h + 2), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
+            self._label_cache = (text, strip, strip.any(axis=2), text_h + 2)
+        _, strip, mask, baseline_row = self._label_cache
+        
+        # Strip origin in frame coordinates, clipped to the frame
+        top, left = y - baseline_row, x - 2
+        t0, l0 = max(top, 0), max(left, 0)
+        t1 = min(top + strip.shape[0], frame.shape[0])
+        l1 = min(left + strip.shape[1], frame.shape[1])
+        if t1 <= t0 or l1 <= l0:
+            return
+        np.copyto(frame[t0:t1, l0:l1], strip[t0-top:t1-top, l0-left:l1-left],
+                  where=mask[t0-top:t1-top, l0-left:l1-left, np.newaxis])
+    
+    def _grabber_loop(self, cap: cv2.VideoCapture):
+        """Read camera frames and keep only the newest one queued"""
+        while not self._stop.is_set():
+            ret, frame = cap.read()
+            if not ret:
+                break
+            self._offer_frame(frame)
+        
+        # None tells the main loop the stream has ended
+        self._offer_frame(None)
+    
+    def _offer_frame(self, frame):
+        """Replace any unconsumed frame with a newer one"""
+        try:
+            self._frames.get_nowait()
+        except queue.Empty:
+            pass
+        self._frames.put_nowait(frame)
+    
     def _handle_audio_interaction(self):
-        """Handle audio-based interaction"""
+        """Start an audio-based interaction without blocking the video loop"""
+        if self._recording:
+            print("Already recording, please wait...")
+            return
+        
         print("\n🎤 Recording audio (3 seconds)...")
+        self._recording = True
+        self._audio_pending = self._audio.submit(self._record_audio_emotion)
+    
+    def _record_audio_emotion(self):
+        """
+        Record and analyse audio (audio worker thread)
+        
+        Returns:
+            Tuple of (audio_emotion, confidence), or None if recording failed
+        """
+        recording = self.audio_detector.record_audio(duration=3.0)
+        if recording is None:
+            return None
+        y, sr = recording
+        return self.audio_detector.get_dominant_emotion(y, sr)
+    
+    def _finish_audio_interaction(self):
+        """Respond to a completed audio recording"""
+        future, self._audio_pending = self._audio_pending, None
+        self._recording = False
         try:
-            audio_path = self.audio_detector.record_audio(duration=3.0)
-            if audio_path:
-                audio_emotion, confidence = self.audio_detector.get_dominant_emotion(audio_path)
+            result = future.result()
+            if result is not None:
+                audio_emotion, confidence = result
                 print(f"Detected audio emotion: {audio_emotion} (confidence: {confidence:.2f})")
                 
                 # Store audio data
                 audio_data = {
-                    'timestamp': datetime.now().isoformat(),
+                    'ts': time.time(),
                     'emotion': audio_emotion,
                     'confidence': confidence
                 }
@@ -198,9 +373,7 @@ class MAITRI:
         
         # Emotion trends
         if self.emotion_history:
-            trend_analysis = self.facial_detector.analyze_emotion_trend(
-                [e['emotions'] for e in self.emotion_history[-20:]]
-            )
+            trend_analysis = self.facial_detector.analyze_emotion_trend()
             print(f"\nEmotion Trend: {trend_analysis['trend']}")
             print(f"Dominant Emotion: {trend_analysis['dominant']}")
             print(f"Confidence: {trend_analysis['confidence']:.2f}")
@@ -226,10 +399,15 @@ class MAITRI:
 
 def main():
     """Main entry point"""
+    parser = argparse.ArgumentParser(description="MAITRI - AI Assistant for Astronaut Well-Being")
+    parser.add_argument('--use-ocl', action='store_true',
+                        help="use OpenCV's OpenCL (UMat) path for frame processing")
+    args = parser.parse_args()
+    
     maitri = MAITRI()
     
     # Run with webcam (change video_source if using different camera)
-    maitri.run(video_source=0, enable_audio=True)
+    maitri.run(video_source=0, enable_audio=True, use_ocl=args.use_ocl)
 
 
 if __name__ == "__main__":
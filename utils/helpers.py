@@ -5,10 +5,25 @@ Helper utility functions
 import os
 import json
 from datetime import datetime
+from functools import lru_cache
 from typing import Dict, List, Optional
 
+# orjson is optional - save_data falls back to the stdlib json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def save_data(data: Dict, filename: str, directory: str = "data"):
+# Write buffer size for save_data
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+def _json_default(obj):
+    """Serialize numpy values as lists/scalars and anything else via str()"""
+    return obj.tolist() if hasattr(obj, 'tolist') else str(obj)
+
+
+def save_data(data: Dict, filename: str, directory: str = "data", compact: bool = False):
     """
     Save data to JSON file
     
@@ -16,12 +31,22 @@ def save_data(data: Dict, filename: str, directory: str = "data"):
         data: Data dictionary to save
         filename: Name of the file
         directory: Directory to save in
+        compact: Skip indentation (smaller, faster output for frequent saves)
     """
     os.makedirs(directory, exist_ok=True)
     filepath = os.path.join(directory, filename)
     
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2, default=str)
+    if orjson is not None:
+        # Datetimes go through default=str, as with the stdlib path
+        option = (orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS |
+                  orjson.OPT_PASSTHROUGH_DATETIME)
+        if not compact:
+            option |= orjson.OPT_INDENT_2
+        with open(filepath, 'wb', buffering=WRITE_BUFFER_SIZE) as f:
+            f.write(orjson.dumps(data, option=option, default=str))
+    else:
+        with open(filepath, 'w', buffering=WRITE_BUFFER_SIZE) as f:
+            json.dump(data, f, indent=None if compact else 2, default=_json_default)
 
 
 def load_data(filename: str, directory: str = "data") -> Optional[Dict]:
@@ -33,14 +58,24 @@ def load_data(filename: str, directory: str = "data") -> Optional[Dict]:
         directory: Directory to load from
         
     Returns:
-        Loaded data dictionary or None
+        Loaded data dictionary or None. The file's bytes are cached until it
+        changes, but every call parses them into a fresh dictionary.
     """
     filepath = os.path.join(directory, filename)
     
-    if os.path.exists(filepath):
-        with open(filepath, 'r') as f:
-            return json.load(f)
-    return None
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    raw = _read_bytes(filepath, st.st_mtime_ns, st.st_size, st.st_ino)
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+@lru_cache(maxsize=64)
+def _read_bytes(filepath: str, mtime_ns: int, size: int, inode: int) -> bytes:
+    """Read a file's contents (the stat fields are only part of the cache key)"""
+    with open(filepath, 'rb') as f:
+        return f.read()
 
 
 def format_timestamp(dt: datetime) -> str:
@@ -74,8 +109,23 @@ def create_report_file(report_content: str, filename: Optional[str] = None) -> s
     
     filepath = os.path.join("reports", filename)
     
-    with open(filepath, 'w') as f:
-        f.write(report_content)
+    # Encode once and write with a single syscall to a temporary file, then
+    # rename it into place so readers never see a partial report; a failed
+    # write removes the temporary file
+    payload = report_content.encode('utf-8')
+    tmp_path = f"{filepath}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        try:
+            view = memoryview(payload)
+            while view:
+                view = view[os.write(fd, view):]
+        finally:
+            os.close(fd)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    os.replace(tmp_path, filepath)
     
     return filepath
 